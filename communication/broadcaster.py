@@ -1,11 +1,49 @@
 import socket, json, time
-from .encryption_utils import encrypt_message
+from .encryption_utils import encrypt_heartbeat
+from .udp_batch import BatchSender
 
-def start_broadcaster(agent_id: str, port=5000, interval=0.1):
+try:
+    import orjson
+    _dumps = orjson.dumps  # returns bytes directly
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode()
+
+def start_broadcaster(agent_id: str, port=5000, interval=0.1, batch=1):
+    # batch > 1 queues that many heartbeats and flushes them in one syscall
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Roomier send buffer so batched bursts don't block on a full queue
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
     target = ("127.0.0.1", port)
+    # The heartbeat never changes, so serialize it once. It is still
+    # encrypted every tick so each packet gets a fresh nonce.
+    data = {"id": agent_id, "status": "ACTIVE", "speed": 25.0}
+    payload = _dumps(data)
+    pending = []
+
+    # Bind everything the loop calls to locals to skip global/attribute lookups
+    encrypt = encrypt_heartbeat
+    sendto = sock.sendto
+    flush = BatchSender(sock, target, batch).send
+    append = pending.append
+    monotonic = time.monotonic
+    sleep = time.sleep
+
+    # Pace against absolute deadlines so sleep overshoot doesn't accumulate
+    next_t = monotonic()
     while True:
-        data = {"id": agent_id, "status": "ACTIVE", "speed": 25.0}
-        message = json.dumps(data)
-        sock.sendto(encrypt_message(message), target)
-        time.sleep(interval)
+        if batch <= 1:
+            sendto(encrypt(payload), target)
+        else:
+            append(encrypt(payload))
+            if len(pending) >= batch:
+                flush(pending)
+                pending.clear()
+        next_t += interval
+        sleep_for = next_t - monotonic()
+        if sleep_for > 0:
+            sleep(sleep_for)
+        elif sleep_for < -interval:
+            # Fell more than a tick behind (e.g. process stalled): resync
+            # instead of firing a burst of catch-up heartbeats
+            next_t = monotonic()
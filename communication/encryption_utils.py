@@ -1,8 +1,25 @@
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import base64
 import os
 
+# Optional Rust-backed cipher; produces the same Fernet tokens, so a sender
+# using it can still talk to a receiver on plain `cryptography`.
+try:
+    from rfernet import Fernet as _FastFernet
+except ImportError:
+    _FastFernet = None
+
 KEY_FILE = "secret.key"
 
+_KEY = None
+_FERNET = None
+_AEAD = None
+
+NONCE_SIZE = 12
+
 def generate_key():
     key = Fernet.generate_key()
     with open(KEY_FILE, "wb") as f:
@@ -10,15 +27,46 @@ def generate_key():
     return key
 
 def load_key():
-    if not os.path.exists(KEY_FILE):
-        return generate_key()
-    with open(KEY_FILE, "rb") as f:
-        return f.read()
+    global _KEY
+    if _KEY is None:
+        if not os.path.exists(KEY_FILE):
+            _KEY = generate_key()
+        else:
+            with open(KEY_FILE, "rb") as f:
+                _KEY = f.read()
+    return _KEY
+
+def _get_fernet():
+    # Build the cipher once per process instead of once per message
+    global _FERNET
+    if _FERNET is None:
+        if _FastFernet is not None:
+            _FERNET = _FastFernet(load_key().decode())
+        else:
+            _FERNET = Fernet(load_key())
+    return _FERNET
 
+# Legacy Fernet API: heartbeats now use the AES-GCM functions below, and
+# nothing in this tree calls these any more
 def encrypt_message(message: str) -> bytes:
-    key = load_key()
-    return Fernet(key).encrypt(message.encode())
+    return _get_fernet().encrypt(message.encode())
 
 def decrypt_message(token: bytes) -> str:
-    key = load_key()
-    return Fernet(key).decrypt(token).decode()
+    return _get_fernet().decrypt(token).decode()
+
+def _get_aead():
+    # Heartbeats use AES-256-GCM with a subkey derived from the shared Fernet
+    # key, so the same key material is never fed to two different ciphers
+    global _AEAD
+    if _AEAD is None:
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"v2-heartbeat-aesgcm")
+        _AEAD = AESGCM(hkdf.derive(base64.urlsafe_b64decode(load_key())))
+    return _AEAD
+
+def encrypt_heartbeat(payload: bytes) -> bytes:
+    """Packet layout: 12-byte random nonce || ciphertext || 16-byte GCM tag."""
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + _get_aead().encrypt(nonce, payload, None)
+
+def decrypt_heartbeat(packet: bytes) -> str:
+    return _get_aead().decrypt(packet[:NONCE_SIZE], packet[NONCE_SIZE:], None).decode()
@@ -1,14 +1,83 @@
+import logging
+import multiprocessing
+import os
+import queue
+import selectors
+import signal
 import socket
-from .encryption_utils import decrypt_message
+from collections import deque
+from .encryption_utils import decrypt_heartbeat
+from .udp_batch import BatchReceiver
 
-def start_receiver(port=5000):
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Most recent decrypted messages, for inspection without per-packet printing.
+# Only filled by start_receiver running in this process; spawn_receiver
+# hands its messages back through a queue instead.
+recent_messages = deque(maxlen=1024)
+
+def _open_socket(port):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Absorb bursts in the kernel instead of dropping datagrams
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    # Lets several receiver threads/processes share the port (Linux, BSD)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     sock.bind(("127.0.0.1", port))
-    print(f"[Receiver] Listening on port {port}")
-    while True:
-        data, _ = sock.recvfrom(2048)
+    # The selector decides when to read, so reads must never block
+    sock.setblocking(False)
+    return sock
+
+def start_receiver(port=5000, extra_ports=(), remember=None, alive=None):
+    # remember: called with each decrypted message (default: recent_messages)
+    # alive: if given, polled about once a second; the loop returns once it is False
+    # One thread services every port through a single selector
+    sel = selectors.DefaultSelector()
+    for p in (port, *extra_ports):
+        sock = _open_socket(p)
+        sel.register(sock, selectors.EVENT_READ, BatchReceiver(sock, size=32, bufsize=65536))
+        print(f"[Receiver] Listening on port {p}")
+    select = sel.select
+    if remember is None:
+        remember = recent_messages.append
+    timeout = None if alive is None else 1.0
+    while alive is None or alive():
+        for key, _ in select(timeout):
+            for data in key.data.recv():
+                try:
+                    msg = decrypt_heartbeat(data)
+                except Exception:
+                    continue
+                remember(msg)
+                logger.debug("Received: %s", msg)
+
+def _receiver_main(port, extra_ports, messages, parent_pid):
+    # Ctrl+C is handled by the parent, which terminates this process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def remember(msg):
         try:
-            msg = decrypt_message(data)
-            print("[Receiver] Received:", msg)
-        except Exception:
-            pass
+            messages.put_nowait(msg)
+        except queue.Full:
+            pass  # nobody is draining the queue; drop rather than block
+
+    # If the parent dies without terminating us we get re-parented, so
+    # exit instead of holding the port forever
+    start_receiver(port, extra_ports, remember, lambda: os.getppid() == parent_pid)
+
+def spawn_receiver(port=5000, extra_ports=()):
+    """
+    Run start_receiver in a separate process so packet decryption doesn't
+    compete with the simulation loop for the GIL. Returns (process, messages):
+    call terminate() on the process when done; `messages` is a
+    multiprocessing queue of decrypted messages, holding at most 1024
+    (newer ones are dropped while it is full). The process also exits on its
+    own within about a second of its parent dying.
+    """
+    # spawn rather than fork: the parent may already hold a Panda3D context
+    ctx = multiprocessing.get_context("spawn")
+    messages = ctx.Queue(maxsize=1024)
+    proc = ctx.Process(target=_receiver_main, args=(port, tuple(extra_ports), messages, os.getpid()), daemon=True)
+    proc.start()
+    return proc, messages
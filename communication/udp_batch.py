@@ -0,0 +1,159 @@
+import ctypes, ctypes.util, errno, os, socket, struct, sys
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _bind_libc(name):
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        return getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+
+
+_sendmmsg = _bind_libc("sendmmsg")
+if _sendmmsg is not None:
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+
+
+_recvmmsg = _bind_libc("recvmmsg")
+if _recvmmsg is not None:
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+
+# Linux <sys/socket.h>: block for the first datagram only, then drain what's queued
+_MSG_WAITFORONE = 0x10000
+
+
+def _sockaddr_in(target):
+    host, port = target
+    raw = struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + socket.inet_aton(host) + bytes(8)
+    return ctypes.create_string_buffer(raw, len(raw))
+
+
+class BatchSender:
+    """
+    Sends up to `size` datagrams to one target per syscall.
+    Uses sendmmsg(2) on Linux and falls back to a sendto() loop elsewhere.
+    """
+
+    def __init__(self, sock, target, size):
+        self.sock = sock
+        self.target = target
+        self.size = size
+        if _sendmmsg is None or size <= 1:
+            self._msgs = None
+            return
+        # Header arrays are built once; only the iovec pointers change per flush
+        self._addr = _sockaddr_in(target)
+        self._iovs = (_IOVec * size)()
+        self._msgs = (_MMsgHdr * size)()
+        for i in range(size):
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.cast(self._addr, ctypes.c_void_p)
+            hdr.msg_namelen = len(self._addr)
+            hdr.msg_iov = ctypes.pointer(self._iovs[i])
+            hdr.msg_iovlen = 1
+
+    def send(self, payloads):
+        if self._msgs is None:
+            for payload in payloads:
+                self.sock.sendto(payload, self.target)
+            return
+        count = len(payloads)
+        # c_char_p points straight at the immutable bytes, no copy needed
+        refs = [ctypes.c_char_p(payload) for payload in payloads]
+        for i, (ref, payload) in enumerate(zip(refs, payloads)):
+            self._iovs[i].iov_base = ctypes.cast(ref, ctypes.c_void_p)
+            self._iovs[i].iov_len = len(payload)
+        fd = self.sock.fileno()
+        base = ctypes.addressof(self._msgs)
+        sent = 0
+        while sent < count:
+            n = _sendmmsg(fd, base + sent * ctypes.sizeof(_MMsgHdr), count - sent, 0)
+            if n < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            sent += n
+
+
+class BatchReceiver:
+    """
+    Drains up to `size` queued datagrams per syscall.
+    Uses recvmmsg(2) on Linux; elsewhere blocks on one recvfrom() and then
+    reads whatever else is already queued with MSG_DONTWAIT.
+    On a non-blocking socket recv() returns [] when nothing is queued.
+    """
+
+    def __init__(self, sock, size=32, bufsize=65536):
+        self.sock = sock
+        self.size = size
+        self.bufsize = bufsize
+        if _recvmmsg is None:
+            self._msgs = None
+            return
+        # One contiguous slab carved into `size` receive buffers
+        self._slab = ctypes.create_string_buffer(size * bufsize)
+        base = ctypes.addressof(self._slab)
+        self._iovs = (_IOVec * size)()
+        self._msgs = (_MMsgHdr * size)()
+        for i in range(size):
+            self._iovs[i].iov_base = base + i * bufsize
+            self._iovs[i].iov_len = bufsize
+            self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovs[i])
+            self._msgs[i].msg_hdr.msg_iovlen = 1
+
+    def recv(self):
+        if self._msgs is None:
+            return self._recv_fallback()
+        fd = self.sock.fileno()
+        while True:
+            n = _recvmmsg(fd, ctypes.addressof(self._msgs), self.size, _MSG_WAITFORONE, None)
+            if n >= 0:
+                break
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            if err != errno.EINTR:
+                raise OSError(err, os.strerror(err))
+        base = ctypes.addressof(self._slab)
+        bufsize = self.bufsize
+        msgs = self._msgs
+        return [ctypes.string_at(base + i * bufsize, msgs[i].msg_len) for i in range(n)]
+
+    def _recv_fallback(self):
+        recvfrom = self.sock.recvfrom
+        try:
+            datagrams = [recvfrom(self.bufsize)[0]]
+        except BlockingIOError:
+            return []
+        dontwait = getattr(socket, "MSG_DONTWAIT", None)
+        if dontwait is None:
+            return datagrams
+        while len(datagrams) < self.size:
+            try:
+                datagrams.append(recvfrom(self.bufsize, dontwait)[0])
+            except BlockingIOError:
+                break
+        return datagrams
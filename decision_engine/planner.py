@@ -1,10 +1,18 @@
+import math
+import numpy as np
+
+
 def plan_path(start, goal):
     """
     Placeholder for Hybrid A* path planner.
     Currently returns a simple straight-line trajectory.
+    Each waypoint closes 5% of the remaining x-gap to the goal, so the
+    whole path is generated in closed form as an (N, 2) array.
     """
-    path = [start]
-    while abs(goal[0] - path[-1][0]) > 0.1:
-        step = (goal[0] - path[-1][0]) * 0.05
-        path.append((path[-1][0] + step, path[-1][1]))
-    return path
+    gap = goal[0] - start[0]
+    if abs(gap) <= 0.1:
+        n = 0
+    else:
+        n = math.ceil(math.log(0.1 / abs(gap)) / math.log(0.95))
+    xs = start[0] + gap * (1 - 0.95 ** np.arange(n + 1))
+    return np.column_stack([xs, np.full_like(xs, start[1])])
@@ -1,11 +1,17 @@
 from metadrive_env.env_manager import create_env
 from communication.broadcaster import start_broadcaster
-from communication.receiver import start_receiver
+from communication.receiver import spawn_receiver
 import threading
-import time
 import socket
 
 
+# Constant full-throttle action shared by every agent
+CRUISE_ACTION = (0.0, 1.0)
+
+# Draw one frame every RENDER_EVERY simulation steps
+RENDER_EVERY = 2
+
+
 def run_simulation():
     """Run the MetaDrive multi-agent simulation with communication system."""
     print("[System] Initializing simulation environment...")
@@ -31,30 +37,39 @@ def run_simulation():
             print(f"[Warning] Port {TEST_PORT} already in use, switching to 5001.")
             TEST_PORT = 5001
 
-    # --- Step 3: Start Communication Threads ---
-    recv_thread = threading.Thread(target=start_receiver, args=(TEST_PORT,), daemon=True)
+    # --- Step 3: Start Communication (receiver process, broadcaster thread) ---
+    recv_proc, _ = spawn_receiver(TEST_PORT)
     send_thread = threading.Thread(target=start_broadcaster, args=("Agent_1", TEST_PORT), daemon=True)
-    recv_thread.start()
     send_thread.start()
 
-    print("[System] Communication threads running. Starting simulation...")
+    print("[System] Communication workers running. Starting simulation...")
+
+    render_enabled = env.config["use_render"]
 
     # --- Step 4: Main Simulation Loop ---
     try:
+        actions = {}
+        dones = {}
         for step in range(1000):
             # Each observation is a dict (agent_id -> obs)
-            actions = {agent_id: [0.0, 1.0] for agent_id in obs.keys()}
+            # Agent set rarely changes; rebuild the action dict only when it does
+            if actions.keys() != obs.keys():
+                actions = dict.fromkeys(obs, CRUISE_ACTION)
             
             # ✅ Fixed: env.step() returns (obs, rewards, terminated, truncated, infos)
             step_result = env.step(actions)
             obs, rewards, terminated, truncated, infos = step_result
             
             # Combine terminated and truncated to get dones
-            dones = {agent_id: terminated.get(agent_id, False) or truncated.get(agent_id, False) 
-                     for agent_id in obs.keys()}
+            # MetaDrive keys terminated/truncated by every agent in obs (plus "__all__")
+            if dones.keys() != obs.keys():
+                dones = dict.fromkeys(obs, False)
+            for agent_id in dones:
+                dones[agent_id] = terminated[agent_id] or truncated[agent_id]
 
-            # Render the simulation
-            env.render()
+            # Render the simulation (skipped entirely when running headless)
+            if render_enabled and step % RENDER_EVERY == 0:
+                env.render()
 
             # Reset when all agents are done
             if all(dones.values()):
@@ -64,11 +79,10 @@ def run_simulation():
                 else:
                     obs = reset_result
 
-            time.sleep(0.01)
-
     except KeyboardInterrupt:
         print("[System] Simulation interrupted by user.")
     finally:
+        recv_proc.terminate()
         env.close()
         print("[System] Simulation ended cleanly.")
 
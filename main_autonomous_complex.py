@@ -5,11 +5,20 @@ Realistic road networks with intersections, curves, and roundabouts
 
 from metadrive.envs.marl_envs import MultiAgentMetaDrive
 from communication.broadcaster import start_broadcaster
-from communication.receiver import start_receiver
+from communication.receiver import spawn_receiver
 import threading
 import time
 import socket
 import sys
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python
+    def njit(*args, **kwargs):
+        return lambda fn: fn
 
 
 # Available map configurations
@@ -23,6 +32,15 @@ MAP_CONFIGS = {
     "default": "XCTOX",  # Balanced default
 }
 
+# Collision avoidance thresholds (meters)
+DANGER_DISTANCE = 10.0  # Very close - brake hard
+WARNING_DISTANCE = 20.0  # Getting close - slow down
+SAFE_DISTANCE = 30.0  # Comfortable distance
+SIDE_DISTANCE = 5.0  # Obstacle alongside - nudge steering / cap throttle
+
+# Draw one frame every RENDER_EVERY simulation steps
+RENDER_EVERY = 2
+
 
 def create_complex_env(num_agents: int = 10, map_config: str = "city", num_scenarios: int = 50):
     """Create environment with complex procedural maps"""
@@ -83,6 +101,7 @@ def create_complex_env(num_agents: int = 10, map_config: str = "city", num_scena
         raise e
 
 
+@lru_cache(maxsize=None)
 def decode_map(map_string: str) -> str:
     """Decode map string to readable description"""
     legend = {
@@ -96,34 +115,26 @@ def decode_map(map_string: str) -> str:
     return " → ".join(parts)
 
 
-def get_safe_action(obs, agent_id):
+@njit(cache=True)
+def _safe_action(lidar, side):
     """
-    Generate safe action based on sensor data to avoid collisions.
-    Uses lidar and side detector to maintain safe distances.
+    Numeric core of get_safe_action.
+    lidar: float32 lidar distances; side: float32 side detector readings
+    (empty when unavailable). Returns (steering, throttle).
     """
-    agent_obs = obs[agent_id]
-    
     # Default action: moderate acceleration, no steering
     steering = 0.0
     throttle = 0.7
-    
-    # Get lidar data (240 points covering 360 degrees)
-    lidar = agent_obs.get('lidar', {}).get('cloud_points', [])
-    
-    if len(lidar) > 0:
+
+    if lidar.size > 0:
         # Check front sector (roughly -30 to +30 degrees)
         # Lidar points are arranged in a circle, front is around indices 90-150
         front_sector = lidar[90:150]
-        
-        if len(front_sector) > 0:
+
+        if front_sector.size > 0:
             # Find minimum distance in front
-            min_front_distance = min(front_sector)
-            
-            # Safety thresholds
-            DANGER_DISTANCE = 10.0  # Very close - brake hard
-            WARNING_DISTANCE = 20.0  # Getting close - slow down
-            SAFE_DISTANCE = 30.0  # Comfortable distance
-            
+            min_front_distance = front_sector.min()
+
             if min_front_distance < DANGER_DISTANCE:
                 # Emergency brake
                 throttle = -0.5
@@ -136,34 +147,97 @@ def get_safe_action(obs, agent_id):
             else:
                 # Safe to proceed
                 throttle = 0.7
-        
+
         # Check left and right for lane changes (if needed)
         left_sector = lidar[150:180]
         right_sector = lidar[60:90]
-        
-        if len(left_sector) > 0 and len(right_sector) > 0:
-            min_left = min(left_sector)
-            min_right = min(right_sector)
-            
+
+        if left_sector.size > 0 and right_sector.size > 0:
+            min_left = left_sector.min()
+            min_right = right_sector.min()
+
             # Slight steering adjustments to avoid very close obstacles
-            if min_left < 5.0:
+            if min_left < SIDE_DISTANCE:
                 steering = 0.1  # Steer slightly right
-            elif min_right < 5.0:
+            elif min_right < SIDE_DISTANCE:
                 steering = -0.1  # Steer slightly left
-    
+
+    # side_detector: [left_front, left_rear, right_rear, right_front]
+    if side.size >= 4:
+        # If vehicles very close on sides, be extra careful
+        if side[0] < SIDE_DISTANCE or side[3] < SIDE_DISTANCE:
+            throttle = min(throttle, 0.3)  # Slow down if cars adjacent
+
+    return steering, throttle
+
+
+_NO_SIDE_DETECTOR = np.empty(0, dtype=np.float32)
+
+# Shared default for agents missing from the step's info dict
+_NO_INFO = {}
+
+
+def get_safe_action(obs, agent_id):
+    """
+    Generate safe action based on sensor data to avoid collisions.
+    Uses lidar and side detector to maintain safe distances.
+    """
+    agent_obs = obs[agent_id]
+
+    # Get lidar data (240 points covering 360 degrees)
+    lidar = np.asarray(agent_obs.get('lidar', {}).get('cloud_points', []), dtype=np.float32)
+
     # Get side detector data for additional safety
     side_detector = agent_obs.get('side_detector', [])
     if isinstance(side_detector, list) and len(side_detector) >= 4:
-        # side_detector: [left_front, left_rear, right_rear, right_front]
-        left_front, left_rear, right_rear, right_front = side_detector
-        
-        # If vehicles very close on sides, be extra careful
-        if left_front < 5.0 or right_front < 5.0:
-            throttle = min(throttle, 0.3)  # Slow down if cars adjacent
-    
+        side = np.asarray(side_detector[:4], dtype=np.float32)
+    else:
+        side = _NO_SIDE_DETECTOR
+
+    steering, throttle = _safe_action(lidar, side)
     return [steering, throttle]
 
 
+def _side_blocked(agent_obs):
+    side_detector = agent_obs.get('side_detector', [])
+    return (isinstance(side_detector, list) and len(side_detector) >= 4
+            and (side_detector[0] < SIDE_DISTANCE or side_detector[3] < SIDE_DISTANCE))
+
+
+def get_safe_actions(obs, agent_ids):
+    """
+    Batched get_safe_action: computes actions for all agents at once on a
+    stacked (num_agents, num_lasers) lidar array.
+    Falls back to per-agent evaluation when lidar scans differ in length
+    or are too short to cover every sector.
+    """
+    if not agent_ids:
+        return {}
+
+    scans = [obs[agent_id].get('lidar', {}).get('cloud_points', []) for agent_id in agent_ids]
+    num_lasers = len(scans[0])
+    if num_lasers < 180 or any(len(scan) != num_lasers for scan in scans):
+        return {agent_id: get_safe_action(obs, agent_id) for agent_id in agent_ids}
+
+    lidar = np.asarray(scans, dtype=np.float32)
+    front = lidar[:, 90:150].min(axis=1)
+    left = lidar[:, 150:180].min(axis=1)
+    right = lidar[:, 60:90].min(axis=1)
+
+    throttle = np.select(
+        [front < DANGER_DISTANCE, front < WARNING_DISTANCE, front < SAFE_DISTANCE],
+        [-0.5, 0.2, 0.4],
+        default=0.7,
+    )
+    steering = np.where(left < SIDE_DISTANCE, 0.1, np.where(right < SIDE_DISTANCE, -0.1, 0.0))
+
+    side_blocked = np.fromiter((_side_blocked(obs[agent_id]) for agent_id in agent_ids),
+                               dtype=bool, count=len(agent_ids))
+    throttle = np.where(side_blocked, np.minimum(throttle, 0.3), throttle)
+
+    return {agent_id: [s, t] for agent_id, s, t in zip(agent_ids, steering.tolist(), throttle.tolist())}
+
+
 def run_complex_simulation(map_config="city"):
     """Run autonomous multi-agent simulation with complex maps and collision avoidance."""
     print("=" * 70)
@@ -196,50 +270,52 @@ def run_complex_simulation(map_config="city"):
             print(f"[Warning] Port {TEST_PORT} already in use, switching to 5001.")
             TEST_PORT = 5001
 
-    # --- Step 3: Start Communication Threads ---
-    recv_thread = threading.Thread(target=start_receiver, args=(TEST_PORT,), daemon=True)
+    # --- Step 3: Start Communication (receiver process, broadcaster thread) ---
+    recv_proc, _ = spawn_receiver(TEST_PORT)
     send_thread = threading.Thread(target=start_broadcaster, args=("Autonomous_Agent", TEST_PORT), daemon=True)
-    recv_thread.start()
     send_thread.start()
 
-    print(f"[System] Communication threads running on port {TEST_PORT}")
+    print(f"[System] Communication workers running on port {TEST_PORT}")
     print("[System] Starting autonomous simulation with collision avoidance...")
     print("[System] Press Ctrl+C to exit")
     print()
 
+    render_enabled = env.config["use_render"]
+
     # --- Step 4: Main Simulation Loop ---
     try:
         step = 0
         episode = 0
         collision_count = 0
+        agent_ids = tuple(obs)
         
         while True:
-            # Generate safe actions for each agent using sensor data
-            actions = {}
-            for agent_id in obs.keys():
-                actions[agent_id] = get_safe_action(obs, agent_id)
+            # Generate safe actions for all agents using sensor data
+            actions = get_safe_actions(obs, agent_ids)
             
             # Step the environment
             step_result = env.step(actions)
             obs, rewards, terminated, truncated, infos = step_result
+            agent_ids = tuple(obs)
+            info_get = infos.get
             
-            # Combine terminated and truncated
-            dones = {agent_id: terminated.get(agent_id, False) or truncated.get(agent_id, False) 
-                     for agent_id in obs.keys()}
-            
-            # Count collisions
-            for agent_id in obs.keys():
-                if infos.get(agent_id, {}).get('crash', False):
+            # Combine terminated and truncated, counting collisions in the same pass.
+            # MetaDrive keys both by every agent in obs (plus "__all__").
+            dones = {}
+            for agent_id in agent_ids:
+                dones[agent_id] = terminated[agent_id] or truncated[agent_id]
+                if info_get(agent_id, _NO_INFO).get('crash', False):
                     collision_count += 1
 
-            # Render the simulation
-            env.render()
+            # Render the simulation (skipped entirely when running headless)
+            if render_enabled and step % RENDER_EVERY == 0:
+                env.render()
             
             step += 1
 
             # Print status every 100 steps
             if step % 100 == 0:
-                active_agents = len(obs.keys())
+                active_agents = len(agent_ids)
                 done_agents = sum(1 for done in dones.values() if done)
                 print(f"[Step {step:5d}] Episode: {episode} | Active: {active_agents} | Done: {done_agents} | Collisions: {collision_count}")
 
@@ -249,14 +325,14 @@ def run_complex_simulation(map_config="city"):
                 
                 # Calculate episode statistics
                 total_reward = sum(rewards.values())
-                successes = sum(1 for agent_id in obs.keys() 
-                               if infos.get(agent_id, {}).get('arrive_dest', False))
+                successes = sum(1 for agent_id in agent_ids
+                               if info_get(agent_id, _NO_INFO).get('arrive_dest', False))
                 
                 print()
                 print("=" * 70)
                 print(f"Episode {episode} Complete!")
                 print(f"  Steps: {step}")
-                print(f"  Successful agents: {successes}/{len(obs)}")
+                print(f"  Successful agents: {successes}/{len(agent_ids)}")
                 print(f"  Total collisions: {collision_count}")
                 print(f"  Total reward: {total_reward:.2f}")
                 print("=" * 70)
@@ -268,16 +344,16 @@ def run_complex_simulation(map_config="city"):
                     obs, info = reset_result
                 else:
                     obs = reset_result
+                agent_ids = tuple(obs)
                 
                 step = 0
                 collision_count = 0
                 time.sleep(1)  # Brief pause between episodes
 
-            time.sleep(0.01)
-
     except KeyboardInterrupt:
         print("\n[System] Simulation interrupted by user.")
     finally:
+        recv_proc.terminate()
         env.close()
         print("[System] Simulation ended cleanly.")
 
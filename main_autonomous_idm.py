@@ -6,12 +6,19 @@ All vehicles drive intelligently with car-following and collision avoidance
 from metadrive.envs.marl_envs import MultiAgentMetaDrive
 from metadrive.policy.idm_policy import IDMPolicy
 from communication.broadcaster import start_broadcaster
-from communication.receiver import start_receiver
+from communication.receiver import spawn_receiver
 import threading
 import time
 import socket
 
 
+# Constant cruise-control action shared by every agent
+CRUISE_ACTION = (0.0, 0.7)
+
+# Draw one frame every RENDER_EVERY simulation steps
+RENDER_EVERY = 2
+
+
 def create_autonomous_env(num_agents: int = 10, map_name: str = "X", num_scenarios: int = 50):
     """Create environment with autonomous driving (simple cruise control)"""
     print("[System] Initializing autonomous simulation environment...")
@@ -88,37 +95,46 @@ def run_autonomous_simulation():
             print(f"[Warning] Port {TEST_PORT} already in use, switching to 5001.")
             TEST_PORT = 5001
 
-    # --- Step 3: Start Communication Threads ---
-    recv_thread = threading.Thread(target=start_receiver, args=(TEST_PORT,), daemon=True)
+    # --- Step 3: Start Communication (receiver process, broadcaster thread) ---
+    recv_proc, _ = spawn_receiver(TEST_PORT)
     send_thread = threading.Thread(target=start_broadcaster, args=("Autonomous_Agent", TEST_PORT), daemon=True)
-    recv_thread.start()
     send_thread.start()
 
-    print(f"[System] Communication threads running on port {TEST_PORT}")
+    print(f"[System] Communication workers running on port {TEST_PORT}")
     print("[System] Starting autonomous simulation...")
     print("[System] Press Ctrl+C to exit")
     print()
 
+    render_enabled = env.config["use_render"]
+
     # --- Step 4: Main Simulation Loop with IDM Policy ---
     try:
         step = 0
         episode = 0
+        actions = {}
+        dones = {}
         
         while True:
             # Simple autonomous driving: cruise control with moderate acceleration
             # All agents drive forward trying to reach their destinations
-            actions = {agent_id: [0.0, 0.7] for agent_id in obs.keys()}
+            # Agent set rarely changes; rebuild the action dict only when it does
+            if actions.keys() != obs.keys():
+                actions = dict.fromkeys(obs, CRUISE_ACTION)
             
             # Step the environment
             step_result = env.step(actions)
             obs, rewards, terminated, truncated, infos = step_result
             
             # Combine terminated and truncated
-            dones = {agent_id: terminated.get(agent_id, False) or truncated.get(agent_id, False) 
-                     for agent_id in obs.keys()}
-
-            # Render the simulation
-            env.render()
+            # MetaDrive keys terminated/truncated by every agent in obs (plus "__all__")
+            if dones.keys() != obs.keys():
+                dones = dict.fromkeys(obs, False)
+            for agent_id in dones:
+                dones[agent_id] = terminated[agent_id] or truncated[agent_id]
+
+            # Render the simulation (skipped entirely when running headless)
+            if render_enabled and step % RENDER_EVERY == 0:
+                env.render()
             
             step += 1
 
@@ -156,11 +172,10 @@ def run_autonomous_simulation():
                 step = 0
                 time.sleep(1)  # Brief pause between episodes
 
-            time.sleep(0.01)
-
     except KeyboardInterrupt:
         print("\n[System] Simulation interrupted by user.")
     finally:
+        recv_proc.terminate()
         env.close()
         print("[System] Simulation ended cleanly.")
 
@@ -3,83 +3,491 @@ Enhanced environment manager with IDM (Intelligent Driver Model) policy
 for more realistic autonomous driving behavior
 """
 
-from metadrive.envs.marl_envs import MultiAgentMetaDrive
-from metadrive.policy.idm_policy import IDMPolicy
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from types import MappingProxyType
 
-def create_env_with_idm(num_agents: int = 10, map_name: str = "X", num_scenarios: int = 50, 
-                        render_mode: str = "onscreen", use_idm: bool = True):
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# MetaDrive classes, imported on first env construction (see _load_metadrive)
+_METADRIVE = None
+
+# Read-only templates for the config fields that never change between
+# calls; _build_env copies them and fills in the per-call values
+_BASE_CONFIG = MappingProxyType(dict(
+    horizon=2000,
+    start_seed=0,
+
+    # Traffic configuration (density is per call, see create_env_with_idm)
+    random_traffic=True,
+    traffic_mode="hybrid",
+    need_inverse_traffic=True,
+
+    # Rendering
+    window_size=(1280, 720),
+    show_logo=False,
+    show_interface=False,
+
+    # Success/Failure conditions
+    out_of_road_penalty=5.0,
+    crash_vehicle_penalty=5.0,
+    crash_object_penalty=5.0,
+    success_reward=10.0,
+))
+
+# Applied over _BASE_CONFIG when ambient traffic is disabled. Below 0.01
+# density PGTrafficManager spawns nothing, and respawn mode skips its
+# per-step trigger scan over every agent.
+_NO_TRAFFIC_CONFIG = MappingProxyType(dict(
+    traffic_density=0.0,
+    random_traffic=False,
+    traffic_mode="respawn",
+))
+
+_BASE_VEHICLE_CONFIG = MappingProxyType(dict(
+    show_dest_mark=False,
+    show_line_to_dest=False,
+    show_side_detector=False,
+    show_lane_line_detector=False,
+
+    # IDM-specific parameters
+    spawn_lane_index=None,  # Random spawn
+))
+
+# Reusable environments keyed by their EnvSpec. MetaDrive
+# allows one engine per process, so in practice this holds at most one env.
+_ENV_POOL = {}
+_POOL_LOCK = threading.Lock()
+
+
+@dataclass(frozen=True, slots=True)
+class EnvSpec:
+    """
+    Everything create_env_with_idm() needs to build an environment; the
+    fields are documented there. Frozen and hashable, so one spec can be
+    shared, varied with dataclasses.replace() and used as the pool key.
+    """
+    num_agents: int = 10
+    map_name: str = "X"
+    num_scenarios: int = 50
+    render_mode: str = "offscreen"
+    use_idm: bool = True
+    debug_visuals: bool = False
+    decision_repeat: int = 5
+    physics_world_step_size: float = 0.02
+    cpu_affinity: tuple | None = None
+    traffic_density: float = 0.15
+    enable_traffic: bool = True
+    capture_frames: bool = False
+
+    def __post_init__(self):
+        if self.cpu_affinity is not None:
+            object.__setattr__(self, "cpu_affinity", tuple(self.cpu_affinity))
+
+
+_DEFAULT_SPEC = EnvSpec()
+
+
+def create_env_with_idm(spec: EnvSpec | None = None, *, reuse: bool = False, **overrides):
     """
     Create environment with optional IDM policy for realistic autonomous driving.
+
+    Build from `spec` (EnvSpec defaults if omitted) with any keyword
+    `overrides` of its fields applied, e.g. create_env_with_idm(num_agents=5)
+    or create_env_with_idm(spec, map_name="S"). Fields can't be passed
+    positionally.
     
     Args:
         num_agents: Number of agents (max 15)
         map_name: Map layout ("X", "S", "C", "O", "T")
         num_scenarios: Number of different scenarios
-        render_mode: "onscreen" or "offscreen"
+        render_mode: "onscreen" opens a window; "offscreen" (default) runs
+            with no window and, unless capture_frames is set, no rendering
         use_idm: Use Intelligent Driver Model for autonomous behavior
+        debug_visuals: Draw the FPS counter, navigation marks, lidar rays and
+            random vehicle colors. Off by default since each adds scene-graph
+            nodes and draw calls to every frame.
+        decision_repeat: Physics substeps per env.step(). Bullet cost scales
+            linearly with it; lower trades control resolution for speed.
+        physics_world_step_size: Seconds of simulated time per substep.
+        cpu_affinity: Optional iterable of CPU ids to pin the calling thread
+            to, so long rollouts don't migrate between cores and lose cache
+            residency. On Linux this pins only that thread and whatever
+            threads it starts afterwards, so call from the thread that will
+            step the env (ignored where os.sched_setaffinity is unavailable).
+        traffic_density: Share of spawn points filled with ambient traffic.
+        enable_traffic: False spawns no ambient traffic at all, ignoring
+            traffic_density. Agent-vs-agent IDM scenarios don't need it, and
+            traffic vehicles dominate step cost (~150 FPS with 10 vehicles
+            against ~50 FPS with 40).
+        capture_frames: With render_mode="offscreen", render the main view
+            into an offscreen buffer that start_frame_thread() can grab.
+            MetaDrive only allocates that buffer when an image sensor
+            exists, so this also switches every agent's observation to an
+            {image, state} dict from an 84x84 RGB camera, one extra camera
+            render per agent per step. Off by default for that reason.
+
+    reuse: Return a pooled env built earlier from an equal spec. MetaDrive
+        only initializes the engine and loads assets on an env's first
+        reset(), so a pool hit saves that only if the pooled env has been
+        reset before (prewarm_env() does this). Pooled envs are released
+        with close_pool(), not env.close().
     """
-    print("[System] Initializing simulation environment...")
-    print("[INFO] Environment: MultiAgentMetaDrive")
-    print("[INFO] MetaDrive version: 0.4.3")
-    
-    if use_idm:
-        print("[INFO] Agent Policy: IDM (Intelligent Driver Model)")
-        print("[INFO] Features: Car-following, safe distance, collision avoidance")
-    else:
-        print("[INFO] Agent Policy: Manual (controlled via actions)")
+    if spec is None:
+        spec = _DEFAULT_SPEC
+    elif not isinstance(spec, EnvSpec):
+        raise TypeError(
+            f"create_env_with_idm() takes an EnvSpec or keyword arguments, got {type(spec).__name__}; "
+            f"pass fields by name, e.g. create_env_with_idm(num_agents=...)"
+        )
+    spec = replace(spec, **overrides)
+    # Pin here, on the caller's thread, before MetaDrive starts any threads
+    # of its own so they inherit the mask
+    if spec.cpu_affinity is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(spec.cpu_affinity))
+    if not reuse:
+        return _build_env(spec)
 
-    config = dict(
-        num_agents=min(num_agents, 15),
-        horizon=2000,
-        start_seed=0,
-        num_scenarios=num_scenarios,
+    # Held across construction so two threads asking for the same spec
+    # don't both build one
+    with _POOL_LOCK:
+        env = _ENV_POOL.get(spec)
+        if env is None:
+            # Only one MetaDrive engine may exist at a time
+            _close_pooled_envs()
+            env = _build_env(spec)
+            _ENV_POOL[spec] = env
+        return env
 
-        # Map configuration
-        map=map_name,
-        
-        # Traffic configuration
-        traffic_density=0.15,
-        random_traffic=True,
-        traffic_mode="hybrid",
-        need_inverse_traffic=True,
-
-        # Rendering
-        use_render=(render_mode == "onscreen"),
-        window_size=(1280, 720),
-        show_logo=False,
-        show_interface=False,
-        show_fps=True,
-
-        # IDM Policy configuration
-        agent_policy=IDMPolicy if use_idm else None,
-        
-        # Vehicle configuration
-        vehicle_config=dict(
-            show_navi_mark=True,
-            show_lidar=True,
-            random_color=True,
-            
-            # IDM-specific parameters
-            spawn_lane_index=None,  # Random spawn
-        ),
-        
-        # Success/Failure conditions
-        out_of_road_penalty=5.0,
-        crash_vehicle_penalty=5.0,
-        crash_object_penalty=5.0,
-        success_reward=10.0,
-    )
 
+def prewarm_env(**kwargs):
+    """
+    Build a pooled env and reset it once, so the engine start-up and asset
+    loading MetaDrive defers to the first reset() are paid now. A later
+    create_env_with_idm(reuse=True) call with the same arguments returns
+    this env with all of that done. Runs on the calling thread, since
+    Panda3D engine setup must happen on the thread that steps the env.
+    Returns the env.
+    """
+    env = create_env_with_idm(reuse=True, **kwargs)
+    env.reset()
+    return env
+
+
+def close_pool():
+    """Close every pooled environment."""
+    with _POOL_LOCK:
+        _close_pooled_envs()
+
+
+def _close_pooled_envs():
+    while _ENV_POOL:
+        _, env = _ENV_POOL.popitem()
+        env.close()
+
+
+@njit(cache=True)
+def _idm_acceleration(speed, target_speed, has_front, dist, dv, d0, tau, ab, acc_factor, delta):
+    """
+    Numeric core of IDMPolicy.acceleration() (MetaDrive 0.4.3) on plain
+    floats. speed: ego speed in km/h; dv: ego-minus-front velocity projected
+    on the ego heading; dist: gap to the front object (ignored without one).
+    """
+    acceleration = acc_factor * (1.0 - (max(speed, 0.0) / target_speed) ** delta)
+    if has_front:
+        # not_zero(): keep the gap at least 0.01 away from zero
+        if abs(dist) <= 0.01:
+            dist = 0.01 if dist >= 0 else -0.01
+        gap_ratio = (d0 + speed * tau + speed * dv / (2.0 * np.sqrt(ab))) / dist
+        acceleration -= acc_factor * gap_ratio * gap_ratio
+    return acceleration
+
+
+def _load_metadrive():
+    # Deferred so importing this module doesn't pull in Panda3D/Bullet
+    global _METADRIVE
+    if _METADRIVE is None:
+        from metadrive.component.sensors.rgb_camera import RGBCamera
+        from metadrive.envs.marl_envs import MultiAgentMetaDrive
+        from metadrive.policy.idm_policy import IDMPolicy
+
+        class FastIDMPolicy(IDMPolicy):
+            # The attributes IDMPolicy.__init__ assigns (MetaDrive 0.4.3),
+            # stored in fixed slots instead of the instance dict. BasePolicy
+            # defines no __slots__, so its own state still lives in __dict__.
+            __slots__ = ("target_speed", "routing_target_lane", "available_routing_index_range",
+                         "overtake_timer", "enable_lane_change", "disable_idm_deceleration",
+                         "heading_pid", "lateral_pid")
+
+            def acceleration(self, front_obj, dist_to_front):
+                # Same IDM formula as the parent, minus the per-call numpy
+                # scalar overhead; the float math runs in _idm_acceleration
+                ego = self.control_object
+                has_front = bool(front_obj) and not self.disable_idm_deceleration
+                dv = 0.0
+                if has_front:
+                    dv = float(np.dot(ego.velocity_km_h - front_obj.velocity_km_h, ego.heading))
+                return _idm_acceleration(
+                    float(ego.speed_km_h), float(self.target_speed), has_front, float(dist_to_front), dv,
+                    self.DISTANCE_WANTED, self.TIME_WANTED, -self.ACC_FACTOR * self.DEACC_FACTOR,
+                    self.ACC_FACTOR, self.DELTA,
+                )
+
+        _METADRIVE = (MultiAgentMetaDrive, FastIDMPolicy, RGBCamera)
+    return _METADRIVE
+
+
+def _build_env(spec):
+    logger.info("Initializing simulation environment: MultiAgentMetaDrive (MetaDrive 0.4.3)")
+    if spec.use_idm:
+        return _create_idm_env(spec)
+    return _create_manual_env(spec)
+
+
+def _create_idm_env(spec):
+    logger.info("Agent policy: IDM (car-following, safe distance, collision avoidance)")
+    config = _build_config(spec)
+    _, FastIDMPolicy, _ = _load_metadrive()
+    config["agent_policy"] = FastIDMPolicy
+    return _construct(config, spec)
+
+
+def _create_manual_env(spec):
+    logger.info("Agent policy: manual (controlled via actions)")
+    # No agent_policy: MetaDrive's default EnvInputPolicy applies the
+    # actions passed to env.step()
+    return _construct(_build_config(spec), spec)
+
+
+def _build_config(spec):
+    """The MetaDrive config for `spec`, minus the agent policy."""
+    _, _, RGBCamera = _load_metadrive()
+    config = {
+        **_BASE_CONFIG,
+        "traffic_density": spec.traffic_density,
+        "num_agents": min(spec.num_agents, 15),
+        "num_scenarios": spec.num_scenarios,
+        "map": spec.map_name,
+        "use_render": spec.render_mode == "onscreen",
+        "show_fps": spec.debug_visuals,
+        "decision_repeat": spec.decision_repeat,
+        "physics_world_step_size": spec.physics_world_step_size,
+        "vehicle_config": {
+            **_BASE_VEHICLE_CONFIG,
+            "show_navi_mark": spec.debug_visuals,
+            "show_lidar": spec.debug_visuals,
+            "random_color": spec.debug_visuals,
+        },
+    }
+
+    if not spec.enable_traffic:
+        config.update(_NO_TRAFFIC_CONFIG)
+
+    if spec.capture_frames and spec.render_mode == "offscreen":
+        # MetaDrive only allocates an offscreen buffer when an image sensor exists
+        config["image_observation"] = True
+        config["sensors"] = dict(rgb_camera=(RGBCamera, 84, 84))
+    return config
+
+
+def _construct(config, spec):
+    MultiAgentMetaDrive, _, _ = _load_metadrive()
     try:
         env = MultiAgentMetaDrive(config)
-        print(f"[INFO] ✅ Environment initialized successfully with map '{map_name}'")
-        if use_idm:
-            print("[INFO] 🤖 All agents will drive autonomously using IDM policy")
+        logger.info("Environment ready: map=%s agents=%d idm=%s", spec.map_name, config["num_agents"], spec.use_idm)
         return env
-    except Exception as e:
-        print("[ERROR] ❌ Failed to initialize MetaDrive environment.")
-        print(f"[ERROR] Details: {str(e)}")
-        raise e
+    except (RuntimeError, ImportError, OSError):
+        # Engine/asset failures; config mistakes surface as their own errors
+        logger.exception("Failed to initialize MetaDrive environment map=%s", spec.map_name)
+        raise
+
+
+def start_frame_thread(env):
+    """
+    Turn screenshots into RGB frames on a worker thread, so the stepping
+    loop only pays for the grab itself. Returns (capture, frames, stop).
+
+    Call capture() on the thread that steps the env whenever a frame is
+    wanted (e.g. every K steps): Panda3D's GL state may only be touched from
+    that thread, so the screenshot is taken there and just the conversion is
+    handed off. `frames` is a queue holding only the latest (H, W, 3) uint8
+    frame, and setting the `stop` event ends the worker.
+
+    Frames are read-only views of the screenshot's RAM image, so no copy is
+    made. (MetaDrive's image_on_cuda path would keep frames on the GPU, but
+    0.4.3 rejects it for multi-agent envs.)
+    """
+    textures = queue.Queue(maxsize=1)
+    frames = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def capture():
+        texture = env.engine.win.getScreenshot()
+        if texture is not None:
+            _put_latest(textures, texture)
+
+    def _convert():
+        while not stop.is_set():
+            try:
+                texture = textures.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            frame = np.frombuffer(texture.getRamImageAs("RGB"), dtype=np.uint8)
+            frame = frame.reshape(texture.getYSize(), texture.getXSize(), 3)[::-1]
+            _put_latest(frames, frame)
+
+    threading.Thread(target=_convert, daemon=True).start()
+    return capture, frames, stop
+
+
+def _put_latest(q, item):
+    # Single-producer queues of size 1: replace whatever is still unread
+    try:
+        q.get_nowait()
+    except queue.Empty:
+        pass
+    q.put_nowait(item)
+
+
+def zero_actions(agent_ids):
+    """
+    Build a {agent_id: float32 zeros(2)} action dict to pass to env.step().
+    MultiAgentMetaDrive indexes the actions by agent id even when IDM is
+    driving (IDMPolicy ignores the values), so env.step(None) does not work.
+    Build it once and reuse it; rebuild only when the set of agents changes.
+    """
+    return {agent_id: np.zeros(2, dtype=np.float32) for agent_id in agent_ids}
+
+
+def snapshot_agents(env):
+    """
+    Record every active agent's position, heading and velocity, keyed by
+    agent id, as plain floats (picklable). Take it right after env.reset()
+    and hand it to fast_reset() to return to that start.
+    """
+    return {
+        agent_id: (tuple(agent.position), float(agent.heading_theta), tuple(agent.velocity))
+        for agent_id, agent in env.agents.items()
+    }
+
+
+def fast_reset(env, snapshot):
+    """
+    Put agents back to a snapshot_agents() pose without regenerating the map
+    or respawning vehicles, and return (obs, info) like env.reset().
+
+    Each agent's navigation is re-planned from its (unchanged) spawn point
+    and re-localized, and the engine's episode step restarts at 0, so route
+    progress, arrival checks and the horizon count behave as after a reset.
+
+    Only possible while exactly the snapshotted agents are still active; if
+    any has finished or been respawned since, this falls back to a full
+    env.reset(). Traffic vehicles, the scenario and per-vehicle episode
+    counters (e.g. energy use) are not rewound, so use it for repeated short
+    rollouts from one start, not between episodes.
+    """
+    agents = env.agents
+    if agents.keys() != snapshot.keys():
+        return env.reset()
+    for agent_id, (position, heading, velocity) in snapshot.items():
+        agent = agents[agent_id]
+        agent.set_position(position)
+        agent.set_heading_theta(heading)
+        agent.set_velocity(velocity)
+        agent.set_angular_velocity(0.0)
+        # Route and checkpoint progress feed the state obs and arrive_dest
+        agent.reset_navigation()
+        agent.update_dist_to_left_right()
+    # The per-episode bookkeeping env.reset() clears; MultiAgentMetaDrive
+    # stops respawning once episode_step reaches the horizon
+    env.engine.episode_step = 0
+    env.dones = dict.fromkeys(agents, False)
+    env.episode_rewards = defaultdict(float)
+    env.episode_lengths = defaultdict(int)
+    obs = {agent_id: env.observations[agent_id].observe(agent) for agent_id, agent in agents.items()}
+    return obs, {}
+
+
+def _rollout_worker(task):
+    fn, index, kwargs = task
+    env = create_env_with_idm(**kwargs)
+    try:
+        return fn(env, index)
+    finally:
+        env.close()
+
+
+def run_envs_parallel(fn, count: int, parallel: int = 0, **kwargs):
+    """
+    Build `count` environments with create_env_with_idm(**kwargs), each in
+    its own spawned process, and return [fn(env, index) for each].
+
+    MetaDrive holds one engine per process and an env can't be sent between
+    processes, so `fn` runs next to its env: it must be a module-level
+    (picklable) function that returns picklable results, e.g. episode
+    stats. Use `index` to vary seeds between workers.
+
+    parallel: worker processes to use; 0 means min(count, cpu_count).
+        Each worker pays the full MetaDrive import and asset load (seconds),
+        so with parallel <= 1 everything runs serially in this process
+        instead. Parallelism pays off only when count >= 2 and each fn(env)
+        runs for much longer than that startup.
+
+    Every env is closed once its fn returns, so reuse= (pooling) is
+    rejected.
+    """
+    if "reuse" in kwargs:
+        raise TypeError("run_envs_parallel() closes each env after fn; reuse is not supported")
+    workers = parallel or min(count, os.cpu_count() or 1)
+    tasks = [(fn, index, kwargs) for index in range(count)]
+    if workers <= 1:
+        return [_rollout_worker(task) for task in tasks]
+    # spawn, not fork: Panda3D state must never be forked
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        return pool.map(_rollout_worker, tasks)
+
+
+def make_pacer(hz: float):
+    """
+    Return a wait() that holds a loop to `hz` iterations per second of wall
+    clock. Each call sleeps only what is left of the current tick against
+    an absolute monotonic deadline, then busy-waits the last ~0.1 ms that
+    sleep() can't hit precisely. A loop that falls more than a tick behind
+    is resynced instead of rushing to catch up.
+    """
+    step_ns = int(1e9 / hz)
+    monotonic_ns = time.monotonic_ns
+    sleep = time.sleep
+    next_t = monotonic_ns()
+
+    def wait():
+        nonlocal next_t
+        next_t += step_ns
+        delta = next_t - monotonic_ns()
+        if delta < -step_ns:
+            next_t = monotonic_ns()
+            return
+        if delta > 200_000:
+            sleep((delta - 100_000) / 1e9)
+        while monotonic_ns() < next_t:
+            pass
+
+    return wait
 
 
 def create_env(num_agents: int = 10, map_name: str = "X", num_scenarios: int = 50, 
@@ -99,12 +507,11 @@ def create_env(num_agents: int = 10, map_name: str = "X", num_scenarios: int = 5
 
 # Example usage:
 if __name__ == "__main__":
-    import time
-    
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
     print("Testing IDM-enabled environment...")
     
-    # Create environment with IDM policy
-    env = create_env_with_idm(num_agents=5, map_name="X", use_idm=True)
+    # Create environment with IDM policy (no window, frames captured offscreen)
+    env = create_env_with_idm(num_agents=5, map_name="X", use_idm=True, capture_frames=True)
     
     # Reset
     reset_result = env.reset()
@@ -115,23 +522,39 @@ if __name__ == "__main__":
     
     print(f"[Test] Environment ready with {len(obs)} agents")
     print("[Test] Running 100 steps with IDM policy...")
-    
-    # Run simulation
-    for step in range(100):
-        # With IDM policy, pass None as actions
-        actions = None
-        
-        # Step
-        step_result = env.step(actions)
-        obs, rewards, terminated, truncated, infos = step_result
-        
-        # Render
-        env.render()
-        
-        if step % 20 == 0:
-            print(f"[Test] Step {step}/100")
+
+    capture_frame, frames, stop_frames = start_frame_thread(env)
+    latest_frame = None
+
+    # Keep the loop body to the bare step: bound methods, no per-step printing
+    step_fn = env.step
+    get_frame = frames.get_nowait
+    actions = zero_actions(obs)
+    num_steps = 100
+    # Set to e.g. 50 to watch the run at wall-clock speed; 0 steps flat out
+    realtime_hz = 0
+    wait = make_pacer(realtime_hz) if realtime_hz else None
+    for step in range(num_steps):
+        # IDM ignores the action values; the same zero dict is reused every step
+        obs = step_fn(actions)[0]
+        if obs.keys() != actions.keys():
+            actions = zero_actions(obs)
         
-        time.sleep(0.02)
+        # Every 32 steps grab a frame here and pick up the newest converted
+        # one if it is ready, without waiting
+        if step & 31 == 0:
+            capture_frame()
+            try:
+                latest_frame = get_frame()
+            except queue.Empty:
+                pass
+
+        if wait is not None:
+            wait()
     
+    print(f"[Test] Completed {num_steps} steps")
+    stop_frames.set()
+    if latest_frame is not None:
+        print(f"[Test] Last captured frame: {latest_frame.shape}")
     env.close()
-    print("[Test] ✅ Test completed successfully!")
\ No newline at end of file
+    print("[Test] ✅ Test completed successfully!")